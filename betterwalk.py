@@ -9,14 +9,30 @@ the full license text.
 
 """
 
+import array
+import bisect
+import collections
 import ctypes
+import errno
 import fnmatch
+import heapq
+import json
+import optparse
 import os
+import socket
 import stat
+import struct
 import sys
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
 
 __version__ = '0.6'
-__all__ = ['iterdir', 'iterdir_stat', 'walk']
+__all__ = ['iterdir', 'iterdir_stat', 'walk', 'resumable_walk', 'snapshot']
 
 
 # Windows implementation
@@ -276,17 +292,33 @@ def iterdir(path='.', pattern='*'):
 
 def walk(top, topdown=True, onerror=None, followlinks=False):
     """Just like os.walk(), but faster, as it uses iterdir_stat internally."""
-    # Determine which are files and which are directories
+    return walk_using(iterdir_stat, top, topdown, onerror, followlinks)
+
+
+def split_dir(iterdir_stat_func, path):
+    """List directory at path with iterdir_stat_func and split by type.
+
+    Return (dirs, nondirs, links), where links is the set of names in dirs
+    that are symbolic links. Raise OSError if the directory can't be listed.
+    """
     dirs = []
-    dir_stats = []
     nondirs = []
+    links = set()
+    for name, st in iterdir_stat_func(path, fields=['st_mode_type']):
+        if stat.S_ISDIR(st.st_mode):
+            dirs.append(name)
+            if stat.S_ISLNK(st.st_mode):
+                links.add(name)
+        else:
+            nondirs.append(name)
+    return dirs, nondirs, links
+
+
+def walk_using(iterdir_stat_func, top, topdown, onerror, followlinks):
+    """Implementation of walk(), listing directories with iterdir_stat_func."""
+    # Determine which are files and which are directories
     try:
-        for name, st in iterdir_stat(top, fields=['st_mode_type']):
-            if stat.S_ISDIR(st.st_mode):
-                dirs.append(name)
-                dir_stats.append(st)
-            else:
-                nondirs.append(name)
+        dirs, nondirs, links = split_dir(iterdir_stat_func, top)
     except OSError as err:
         if onerror is not None:
             onerror(err)
@@ -297,12 +329,759 @@ def walk(top, topdown=True, onerror=None, followlinks=False):
         yield top, dirs, nondirs
 
     # Recurse into sub-directories, following symbolic links if "followlinks"
-    for name, st in zip(dirs, dir_stats):
+    for name in dirs:
         new_path = os.path.join(top, name)
-        if followlinks or not stat.S_ISLNK(st.st_mode):
-            for x in walk(new_path, topdown, onerror, followlinks):
+        if followlinks or name not in links:
+            for x in walk_using(iterdir_stat_func, new_path, topdown, onerror,
+                                followlinks):
                 yield x
 
     # Yield before recursion if going bottom up
     if not topdown:
         yield top, dirs, nondirs
+
+
+CHECKPOINT_VERSION = 1
+
+
+def load_checkpoint(checkpoint):
+    """Return (top, pending) from checkpoint file, or None if it doesn't exist.
+
+    "pending" is the stack of directories (relative to top) still to be
+    walked, with the next directory to walk last. Raise ValueError if the
+    checkpoint file is corrupt.
+    """
+    try:
+        f = open(checkpoint)
+    except (IOError, OSError):
+        return None
+    try:
+        try:
+            state = json.load(f)
+            version = state.get('version')
+            top, pending = state['top'], state['pending']
+        except (ValueError, AttributeError, KeyError):
+            raise ValueError('corrupt checkpoint %r, delete it to start the '
+                             'walk again' % checkpoint)
+    finally:
+        f.close()
+    if version != CHECKPOINT_VERSION:
+        raise ValueError('unsupported checkpoint version in %r' % checkpoint)
+    return top, pending
+
+
+def save_checkpoint(checkpoint, top, pending):
+    """Atomically write (top, pending) to checkpoint file."""
+    state = {'version': CHECKPOINT_VERSION, 'top': top, 'pending': pending}
+    temp_name = checkpoint + '.tmp'
+    f = open(temp_name, 'w')
+    try:
+        json.dump(state, f, separators=(',', ':'))
+        # Make sure the data is on disk before the rename, otherwise after a
+        # crash the renamed checkpoint may be empty or truncated
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    if hasattr(os, 'replace'):
+        os.replace(temp_name, checkpoint)
+    else:
+        if sys.platform == 'win32' and os.path.exists(checkpoint):
+            # os.rename() won't overwrite an existing file on Windows
+            os.remove(checkpoint)
+        os.rename(temp_name, checkpoint)
+
+
+def resumable_walk(top, checkpoint, interval=5.0, onerror=None,
+                   followlinks=False):
+    """Like walk(top, topdown=True), but resumable from a checkpoint file.
+
+    Every "interval" seconds the stack of directories still to be walked is
+    saved to the file named by "checkpoint" (paths are stored relative to
+    top, so checkpoints stay small). If that file already exists when the
+    walk starts, the walk continues from the last saved position instead of
+    from the start. The checkpoint file is removed when the walk finishes.
+
+    Only the stack is saved, not the position within a directory, so on
+    resume every directory completed since the last save (up to "interval"
+    seconds of work) is yielded again, as is the directory being processed
+    when the walk was stopped. A directory counts as completed once the
+    caller asks for the next one. As with walk(), removing names from the
+    yielded dirs list prunes the walk.
+    """
+    state = load_checkpoint(checkpoint)
+    if state is not None:
+        saved_top, pending = state
+        if saved_top != top:
+            raise ValueError('checkpoint %r is for %r, not %r' %
+                             (checkpoint, saved_top, top))
+    else:
+        pending = ['']
+    last_save = time.time()
+
+    while pending:
+        rel_path = pending.pop()
+        path = os.path.join(top, rel_path) if rel_path else top
+
+        try:
+            dirs, nondirs, links = split_dir(iterdir_stat, path)
+        except OSError as err:
+            if onerror is not None:
+                onerror(err)
+            continue
+
+        yield path, dirs, nondirs
+
+        # Push in reverse so sub-directories are walked in the same order as
+        # walk() would recurse into them
+        for name in reversed(dirs):
+            if followlinks or name not in links:
+                pending.append(os.path.join(rel_path, name) if rel_path
+                               else name)
+
+        # Only save once the caller has come back for the next directory, so
+        # a saved stack never skips a directory the caller hasn't finished
+        now = time.time()
+        if now - last_save >= interval:
+            save_checkpoint(checkpoint, top, pending)
+            last_save = now
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+class Snapshot(object):
+    """Compact in-memory snapshot of a directory tree, built by snapshot().
+
+    Entries are numbered in pre-order (each directory followed by everything
+    under it), so every subtree is a contiguous range of entries. Each entry
+    is stored in typed arrays as the offset of its name in a buffer of
+    interned, NUL-terminated names, a slot in its directory's name-sorted
+    child order (for fast path lookups), and its size and mtime if those were
+    requested -- 24 bytes per entry with both st_size and st_mtime, plus the
+    bytes of each unique name. Subtree lengths, parents,
+    size totals and whether the directory was listed are only stored for
+    directories (25 bytes per directory). Each sort order built by largest()
+    or newest() adds 4 bytes per file.
+
+    Paths given to and returned from the query methods are rooted at "top",
+    just like the paths from walk().
+    """
+
+    name_encoding = 'utf-8'
+    name_errors = 'surrogatepass'
+
+    def __init__(self, top, fields):
+        self.top = top
+        self.fields = fields
+        self.name_data = bytearray()
+        self.name_offsets = {}
+        self.name_offset = array.array('I')
+        self.sizes = array.array('q') if 'st_size' in fields else None
+        self.mtimes = array.array('d') if 'st_mtime' in fields else None
+        self.dir_entry = array.array('i')
+        self.dir_len = array.array('i')
+        self.dir_parent = array.array('i')
+        self.dir_listed = array.array('B')
+        self.dir_total = array.array('q') if 'st_size' in fields else None
+        self.child_order = None
+        self.child_start = None
+        self.sort_orders = {}
+
+    def add(self, name, st):
+        """Add entry and return its index (only used while building)."""
+        offset = self.name_offsets.get(name)
+        if offset is None:
+            offset = self.name_offsets[name] = len(self.name_data)
+            self.name_data += name.encode(self.name_encoding,
+                                          self.name_errors) + b'\0'
+        self.name_offset.append(offset)
+        if self.sizes is not None:
+            self.sizes.append(st.st_size)
+        if self.mtimes is not None:
+            self.mtimes.append(st.st_mtime)
+        return len(self.name_offset) - 1
+
+    def add_dir(self, index, parent_dir):
+        """Add directory record for entry at index and return its number."""
+        self.dir_entry.append(index)
+        self.dir_len.append(1)
+        self.dir_parent.append(parent_dir)
+        self.dir_listed.append(0)
+        if self.dir_total is not None:
+            self.dir_total.append(0)
+        return len(self.dir_entry) - 1
+
+    def finish(self):
+        """Drop the build-time state and build the name-sorted child order.
+
+        The children of directory k are at child_order[child_start[k]:
+        child_start[k + 1]], sorted by (encoded) name.
+        """
+        self.name_offsets = None
+        self.name_data = bytes(self.name_data)
+        self.child_order = array.array('i')
+        self.child_start = array.array('i', [0])
+        for index in self.dir_entry:
+            children = list(self.children(index))
+            children.sort(key=self.name_bytes)
+            self.child_order.extend(children)
+            self.child_start.append(len(self.child_order))
+
+    def __len__(self):
+        return len(self.name_offset)
+
+    def name_bytes(self, index):
+        """Return encoded name of entry at index."""
+        offset = self.name_offset[index]
+        end = self.name_data.index(b'\0', offset)
+        return self.name_data[offset:end]
+
+    def name(self, index):
+        """Return name of entry at index."""
+        return self.name_bytes(index).decode(self.name_encoding,
+                                             self.name_errors)
+
+    def dir_number(self, index):
+        """Return directory number of entry at index, or None if not a dir."""
+        k = bisect.bisect_left(self.dir_entry, index)
+        if k < len(self.dir_entry) and self.dir_entry[k] == index:
+            return k
+        return None
+
+    def is_dir(self, index):
+        return self.dir_number(index) is not None
+
+    def subtree_len(self, index):
+        """Return number of entries in subtree at index, including itself."""
+        k = self.dir_number(index)
+        return 1 if k is None else self.dir_len[k]
+
+    def parent(self, index):
+        """Return index of parent of entry at index (-1 for the root)."""
+        if index == 0:
+            return -1
+        # Start at the closest directory before index and go up until we
+        # find the one that contains it
+        k = bisect.bisect_left(self.dir_entry, index) - 1
+        while self.dir_entry[k] + self.dir_len[k] <= index:
+            k = self.dir_parent[k]
+        return self.dir_entry[k]
+
+    def children_dirs(self, index):
+        """Yield (child_index, dir_number) for direct children of index.
+
+        The children are yielded in listing order, and dir_number is None
+        for children that aren't directories.
+        """
+        k = self.dir_number(index)
+        if k is None:
+            return
+        end = index + self.dir_len[k]
+        child = index + 1
+        k += 1
+        while child < end:
+            if k < len(self.dir_entry) and self.dir_entry[k] == child:
+                yield child, k
+                child += self.dir_len[k]
+                k = bisect.bisect_left(self.dir_entry, child, k)
+            else:
+                yield child, None
+                child += 1
+
+    def children(self, index):
+        """Yield indexes of the direct children of entry at index."""
+        for child, k in self.children_dirs(index):
+            yield child
+
+    def find_child(self, index, name):
+        """Return index of child of entry at index with given name, or None.
+
+        This is a binary search of the directory's name-sorted child order.
+        """
+        k = self.dir_number(index)
+        if k is None:
+            return None
+        target = name.encode(self.name_encoding, self.name_errors)
+        lo = self.child_start[k]
+        hi = self.child_start[k + 1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.name_bytes(self.child_order[mid]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if (lo < self.child_start[k + 1] and
+                self.name_bytes(self.child_order[lo]) == target):
+            return self.child_order[lo]
+        return None
+
+    def index(self, path):
+        """Return index of entry at path, or raise KeyError if not found."""
+        if path == self.top:
+            return 0
+        prefix = os.path.join(self.top, '')
+        if not path.startswith(prefix):
+            raise KeyError(path)
+        index = 0
+        for name in path[len(prefix):].split(os.sep):
+            if not name:
+                continue
+            index = self.find_child(index, name)
+            if index is None:
+                raise KeyError(path)
+        return index
+
+    def path(self, index):
+        """Return full path of entry at index."""
+        names = []
+        while index > 0:
+            names.append(self.name(index))
+            index = self.parent(index)
+        return os.path.join(self.top, *reversed(names))
+
+    def listdir(self, path):
+        """Return list of names in directory at path, like os.listdir()."""
+        return [self.name(i) for i in self.children(self.index(path))]
+
+    def count(self, path):
+        """Return number of entries under path (not including path itself)."""
+        return self.subtree_len(self.index(path)) - 1
+
+    def total_size(self, path):
+        """Return total size of the non-directory entries under path."""
+        if self.sizes is None:
+            raise ValueError("snapshot doesn't have 'st_size' field")
+        index = self.index(path)
+        k = self.dir_number(index)
+        if k is None:
+            return self.sizes[index]
+        return self.dir_total[k]
+
+    def largest(self, n, path=None):
+        """Return list of (size, path) of the n largest files under path."""
+        if self.sizes is None:
+            raise ValueError("snapshot doesn't have 'st_size' field")
+        return self.top_n('st_size', self.sizes, n, path)
+
+    def newest(self, n, path=None):
+        """Return list of (mtime, path) of the n newest files under path."""
+        if self.mtimes is None:
+            raise ValueError("snapshot doesn't have 'st_mtime' field")
+        return self.top_n('st_mtime', self.mtimes, n, path)
+
+    def file_indexes(self, start, end):
+        """Return array of indexes of non-directory entries in range."""
+        files = array.array('i')
+        k = bisect.bisect_left(self.dir_entry, start)
+        for d in self.dir_entry[k:bisect.bisect_left(self.dir_entry, end)]:
+            files.extend(range(start, d))
+            start = d + 1
+        files.extend(range(start, end))
+        return files
+
+    def top_n(self, field, values, n, path):
+        """Return list of (value, path) of the n highest-valued files."""
+        start = 0 if path is None else self.index(path)
+        if n <= 0:
+            return []
+        end = start + self.subtree_len(start)
+
+        order = self.sort_orders.get(field)
+        if order is None:
+            # Sorting needs a temporary list and key objects for every file
+            order = array.array('i', sorted(self.file_indexes(0, len(self)),
+                                            key=values.__getitem__,
+                                            reverse=True))
+            self.sort_orders[field] = order
+
+        # Scanning the global sort order takes about n * len(order) / subtree
+        # steps to find n entries in the subtree, so for small subtrees it's
+        # faster to just look at every entry in the subtree
+        subtree = end - start
+        if subtree * subtree > n * len(order):
+            indexes = []
+            for i in order:
+                if start <= i < end:
+                    indexes.append(i)
+                    if len(indexes) >= n:
+                        break
+        else:
+            indexes = heapq.nlargest(n, self.file_indexes(start, end),
+                                     key=values.__getitem__)
+        return [(values[i], self.path(i)) for i in indexes]
+
+    def walk(self, top=None, topdown=True):
+        """Like walk(), but walk the snapshot instead of the file system."""
+        index = 0 if top is None else self.index(top)
+        return self.walk_index(index, self.path(index), topdown)
+
+    def walk_index(self, index, top, topdown):
+        k = self.dir_number(index)
+        if k is None or not self.dir_listed[k]:
+            return
+        dirs = []
+        dir_indexes = {}
+        nondirs = []
+        for child, child_k in self.children_dirs(index):
+            name = self.name(child)
+            if child_k is not None:
+                dirs.append(name)
+                dir_indexes[name] = child
+            else:
+                nondirs.append(name)
+
+        if topdown:
+            yield top, dirs, nondirs
+
+        for name in dirs:
+            child = dir_indexes.get(name)
+            if child is not None:
+                for x in self.walk_index(child, os.path.join(top, name),
+                                         topdown):
+                    yield x
+
+        if not topdown:
+            yield top, dirs, nondirs
+
+
+def snapshot(top, fields=None, onerror=None, followlinks=False):
+    """Walk tree at top and return a compact in-memory Snapshot of it.
+
+    "fields" is an iterable of extra 'st_*' fields to store for each entry,
+    which may include 'st_size' and 'st_mtime'. Names and which entries are
+    directories are always stored. "onerror" and "followlinks" are as per
+    walk(). Symbolic links are classified (and followed or not) just like
+    walk() does, and their size and mtime are those of the link itself
+    unless "followlinks" is true.
+    """
+    fields = set(fields or [])
+    unsupported = fields - set(['st_size', 'st_mtime'])
+    if unsupported:
+        raise ValueError('unsupported snapshot fields: {0}'.format(
+            ', '.join(sorted(unsupported))))
+    snap = Snapshot(top, fields)
+
+    def entry_stat(path, st):
+        # Only stat if the listing didn't provide the fields for free, and
+        # use lstat so dangling or looping links don't cause errors
+        if not any(getattr(st, f) is None for f in fields):
+            return st
+        if followlinks and stat.S_ISLNK(st.st_mode):
+            try:
+                return os.stat(path)
+            except OSError:
+                pass
+        return os.lstat(path)
+
+    def list_dir(path, index, dir_num):
+        """Add contents of directory at path; return total size of files."""
+        try:
+            listing = list(iterdir_stat(path, fields=['st_mode_type']))
+        except OSError as err:
+            if onerror is not None:
+                onerror(err)
+            return 0
+        snap.dir_listed[dir_num] = 1
+
+        total = 0
+        for name, st in listing:
+            child_path = os.path.join(path, name)
+            try:
+                full_st = entry_stat(child_path, st)
+            except OSError as err:
+                # Entry was probably removed since the directory was listed
+                if onerror is not None:
+                    onerror(err)
+                continue
+            child = snap.add(name, full_st)
+            if stat.S_ISDIR(st.st_mode):
+                child_dir = snap.add_dir(child, dir_num)
+                if followlinks or not stat.S_ISLNK(st.st_mode):
+                    total += list_dir(child_path, child, child_dir)
+            elif snap.sizes is not None:
+                total += full_st.st_size
+
+        snap.dir_len[dir_num] = len(snap) - index
+        if snap.dir_total is not None:
+            snap.dir_total[dir_num] = total
+        return total
+
+    try:
+        top_stat = os.stat(top) if fields else None
+    except OSError as err:
+        if onerror is not None:
+            onerror(err)
+        # Leave the root unlisted, so walking the snapshot yields nothing
+        snap.add_dir(snap.add(top, os.stat_result((0,) * 10)), -1)
+    else:
+        index = snap.add(top, top_stat)
+        list_dir(top, index, snap.add_dir(index, -1))
+    snap.finish()
+    return snap
+
+# Shared walk server and client, which talk over a Unix domain socket
+if hasattr(socket, 'AF_UNIX'):
+    __all__ += ['WalkClient', 'WalkServer', 'serve']
+
+    # A request is the directory's absolute path, prefixed with its length.
+    # The response for the whole directory is an (errno, payload length)
+    # header followed by the payload. If errno is zero, the payload is a list
+    # of entries, each one the file type bits of st_mode (shifted down to fit
+    # in a byte), the name length, and the name. Otherwise the payload is the
+    # error message.
+    REQUEST_HEADER = struct.Struct('!I')
+    RESPONSE_HEADER = struct.Struct('!iI')
+    ENTRY_HEADER = struct.Struct('!BH')
+
+    # Longest request path the server will read, far more than any real path
+    MAX_PATH_LEN = 65536
+
+    socket_encoding = sys.getfilesystemencoding()
+
+    def read_exactly(f, size):
+        """Read exactly size bytes from file f, or raise EOFError."""
+        data = f.read(size)
+        if len(data) != size:
+            raise EOFError('connection closed after {0} of {1} bytes'.format(
+                len(data), size))
+        return data
+
+    def encode_listing(path):
+        """List directory at path and return (errno, payload) response."""
+        try:
+            parts = []
+            for name, st in iterdir_stat(path, fields=['st_mode_type']):
+                encoded = name.encode(socket_encoding)
+                parts.append(ENTRY_HEADER.pack(stat.S_IFMT(st.st_mode) >> 12,
+                                               len(encoded)))
+                parts.append(encoded)
+            return 0, b''.join(parts)
+        except OSError as err:
+            return (err.errno or errno.EIO,
+                    (err.strerror or str(err)).encode('utf-8'))
+
+    def decode_listing(payload):
+        """Convert listing payload to list of (name, stat_result) tuples."""
+        listing = []
+        pos = 0
+        while pos < len(payload):
+            file_type, name_len = ENTRY_HEADER.unpack_from(payload, pos)
+            pos += ENTRY_HEADER.size
+            name = payload[pos:pos + name_len].decode(socket_encoding)
+            pos += name_len
+            st = os.stat_result((file_type << 12,) + (None,) * 9)
+            listing.append((name, st))
+        return listing
+
+    class PendingRead(object):
+        """Directory read in progress, shared by all requests waiting on it."""
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.response = None
+
+    class ListingCache(object):
+        """Thread-safe cache of encoded directory listings.
+
+        Listings are reused for up to max_age seconds, and when there are
+        more than max_size listings, the least recently used are dropped.
+        Concurrent requests for the same directory are merged, so only one of
+        them reads the file system and the others wait for its result.
+        """
+
+        def __init__(self, max_age=10.0, max_size=100000):
+            self.max_age = max_age
+            self.max_size = max_size
+            self.lock = threading.Lock()
+            self.listings = collections.OrderedDict()
+            self.pending = {}
+
+        def read(self, path):
+            """Read directory at path; return (errno, payload) response."""
+            return encode_listing(path)
+
+        def get(self, path):
+            """Return (errno, payload) response for directory at path."""
+            while True:
+                with self.lock:
+                    entry = self.listings.pop(path, None)
+                    if (entry is not None and
+                            time.time() - entry[0] < self.max_age):
+                        # Re-insert to move it to the most recently used end
+                        self.listings[path] = entry
+                        return entry[1]
+                    pending = self.pending.get(path)
+                    is_reader = pending is None
+                    if is_reader:
+                        pending = self.pending[path] = PendingRead()
+
+                if is_reader:
+                    break
+                pending.done.wait()
+                if pending.response is not None:
+                    return pending.response
+                # The read failed unexpectedly, so try it again ourselves
+
+            try:
+                response = self.read(path)
+                with self.lock:
+                    self.add(path, response)
+                pending.response = response
+            finally:
+                with self.lock:
+                    del self.pending[path]
+                pending.done.set()
+            return response
+
+        def add(self, path, response):
+            """Add response to cache (lock must be held by caller)."""
+            self.listings.pop(path, None)
+            while self.listings and len(self.listings) >= self.max_size:
+                self.listings.popitem(last=False)
+            self.listings[path] = (time.time(), response)
+
+    class WalkRequestHandler(socketserver.StreamRequestHandler):
+        """Answer listing requests on one client connection until closed."""
+
+        def handle(self):
+            cache = self.server.cache
+            while True:
+                try:
+                    header = read_exactly(self.rfile, REQUEST_HEADER.size)
+                    path_len, = REQUEST_HEADER.unpack(header)
+                    if path_len > MAX_PATH_LEN:
+                        # Can't skip the path and stay in sync, so give up
+                        # on this connection after replying
+                        self.send_response(errno.EINVAL, b'path too long')
+                        break
+                    path = read_exactly(self.rfile, path_len)
+                except EOFError:
+                    break
+
+                try:
+                    path = path.decode(socket_encoding)
+                except UnicodeDecodeError:
+                    self.send_response(errno.EINVAL, b'invalid path encoding')
+                    continue
+                try:
+                    error, payload = cache.get(path)
+                except Exception as err:
+                    error, payload = errno.EIO, str(err).encode('utf-8')
+                self.send_response(error, payload)
+
+        def send_response(self, error, payload):
+            self.wfile.write(RESPONSE_HEADER.pack(error, len(payload)) +
+                             payload)
+            self.wfile.flush()
+
+    class WalkServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+        """Server that lists directories for WalkClients over a Unix socket."""
+
+        daemon_threads = True
+
+        def __init__(self, socket_path, max_age=10.0, max_size=100000):
+            socketserver.UnixStreamServer.__init__(self, socket_path,
+                                                   WalkRequestHandler)
+            self.cache = ListingCache(max_age=max_age, max_size=max_size)
+
+    class WalkClient(object):
+        """Client for WalkServer with an iterdir_stat() and walk() API.
+
+        Only type information (st_mode_type) is provided in each stat_result.
+        A WalkClient uses a single connection, so it shouldn't be shared
+        between threads.
+        """
+
+        def __init__(self, socket_path):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(socket_path)
+            self.rfile = self.sock.makefile('rb')
+
+        def close(self):
+            self.rfile.close()
+            self.sock.close()
+
+        def iterdir_stat(self, path='.', pattern='*', fields=None):
+            """Like iterdir_stat(), but list directory via the server.
+
+            Unlike iterdir_stat(), this returns the whole listing as a list.
+            Only the 'st_mode_type' field is supported; ValueError is raised
+            if "fields" includes any others.
+            """
+            if fields is not None:
+                unsupported = set(fields) - set(['st_mode_type'])
+                if unsupported:
+                    raise ValueError('unsupported WalkClient fields: ' +
+                                     ', '.join(sorted(unsupported)))
+            encoded = os.path.abspath(path).encode(socket_encoding)
+            self.sock.sendall(REQUEST_HEADER.pack(len(encoded)) + encoded)
+            header = read_exactly(self.rfile, RESPONSE_HEADER.size)
+            error, payload_len = RESPONSE_HEADER.unpack(header)
+            payload = read_exactly(self.rfile, payload_len)
+            if error:
+                exc = OSError(error, payload.decode('utf-8'))
+                exc.filename = path
+                raise exc
+            listing = decode_listing(payload)
+            if pattern != '*':
+                listing = [(name, st) for name, st in listing
+                           if fnmatch.fnmatch(name, pattern)]
+            return listing
+
+        def walk(self, top, topdown=True, onerror=None, followlinks=False):
+            """Like walk(), but list directories via the server."""
+            return walk_using(self.iterdir_stat, top, topdown, onerror,
+                              followlinks)
+
+    def serve(socket_path, max_age=10.0, max_size=100000):
+        """Run a WalkServer on socket_path until interrupted."""
+        if os.path.exists(socket_path):
+            # Remove stale socket file, but not if a server is still using it
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(socket_path)
+            except socket.error:
+                os.remove(socket_path)
+            else:
+                raise OSError(errno.EADDRINUSE,
+                              'server already running on ' + socket_path)
+            finally:
+                sock.close()
+
+        server = WalkServer(socket_path, max_age=max_age, max_size=max_size)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(socket_path)
+
+
+def main():
+    """Usage: betterwalk.py serve [-h] [-a MAX_AGE] [-n MAX_SIZE] socket_path
+
+Run a shared walk server on the Unix domain socket socket_path, so that many
+local processes can walk the same trees via WalkClient while the directory
+reading and caching is done just once.
+"""
+    parser = optparse.OptionParser(usage=main.__doc__.rstrip())
+    parser.add_option('-a', '--max-age', type='float', default=10.0,
+                      help='seconds to cache each listing (default %default)')
+    parser.add_option('-n', '--max-size', type='int', default=100000,
+                      help='max directories to cache (default %default)')
+    options, args = parser.parse_args()
+
+    if len(args) != 2 or args[0] != 'serve':
+        parser.error('expected "serve socket_path" arguments')
+    if not hasattr(socket, 'AF_UNIX'):
+        parser.error('Unix domain sockets not supported on this system')
+
+    try:
+        serve(args[1], max_age=options.max_age, max_size=options.max_size)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
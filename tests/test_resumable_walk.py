@@ -0,0 +1,75 @@
+"""Tests for betterwalk.resumable_walk()."""
+
+import os
+import shutil
+import unittest
+
+import betterwalk
+
+class ResumableWalkTests(unittest.TestCase):
+    testfn = os.path.join(os.path.dirname(__file__), 'temp_resumable')
+    checkpoint = testfn + '.checkpoint'
+
+    def setUp(self):
+        # Build TESTFN/{A,B,C}/{X,Y} with a file in each directory
+        for top_name in 'ABC':
+            for sub_name in 'XY':
+                os.makedirs(os.path.join(self.testfn, top_name, sub_name))
+        for root, dirs, files in betterwalk.walk(self.testfn):
+            f = open(os.path.join(root, 'file'), 'w')
+            f.close()
+
+    def test_same_as_walk(self):
+        expected = list(betterwalk.walk(self.testfn))
+        walked = list(betterwalk.resumable_walk(self.testfn, self.checkpoint))
+        self.assertEqual(walked, expected)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume(self):
+        expected = [root for root, dirs, files in betterwalk.walk(self.testfn)]
+
+        # Stop part way through, checkpointing after every directory
+        walker = betterwalk.resumable_walk(self.testfn, self.checkpoint,
+                                           interval=0)
+        first = [next(walker)[0] for i in range(4)]
+        walker.close()
+        self.assertTrue(os.path.exists(self.checkpoint))
+
+        # The fourth directory wasn't completed, so it's yielded again
+        rest = [root for root, dirs, files in
+                betterwalk.resumable_walk(self.testfn, self.checkpoint)]
+        self.assertEqual(first[:3] + rest, expected)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume_repeats_unsaved(self):
+        expected = [root for root, dirs, files in betterwalk.walk(self.testfn)]
+
+        # Nothing is saved before the interval is up, so directories
+        # completed since the last save are yielded again on resume
+        walker = betterwalk.resumable_walk(self.testfn, self.checkpoint,
+                                           interval=3600)
+        for i in range(4):
+            next(walker)
+        walker.close()
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        rest = [root for root, dirs, files in
+                betterwalk.resumable_walk(self.testfn, self.checkpoint)]
+        self.assertEqual(rest, expected)
+
+    def test_wrong_top(self):
+        betterwalk.save_checkpoint(self.checkpoint, 'elsewhere', [''])
+        walker = betterwalk.resumable_walk(self.testfn, self.checkpoint)
+        self.assertRaises(ValueError, next, walker)
+
+    def test_corrupt_checkpoint(self):
+        f = open(self.checkpoint, 'w')
+        f.write('{"version": 1, "top"')
+        f.close()
+        walker = betterwalk.resumable_walk(self.testfn, self.checkpoint)
+        self.assertRaises(ValueError, next, walker)
+
+    def tearDown(self):
+        shutil.rmtree(self.testfn)
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
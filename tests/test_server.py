@@ -0,0 +1,165 @@
+"""Tests for betterwalk's shared walk server and client."""
+
+import errno
+import os
+import shutil
+import socket
+import struct
+import threading
+import time
+import unittest
+
+import betterwalk
+
+@unittest.skipUnless(hasattr(betterwalk, 'WalkServer'),
+                     'requires Unix domain sockets')
+class ServerTests(unittest.TestCase):
+    testfn = os.path.join(os.path.dirname(__file__), 'temp_server')
+    socket_path = testfn + '.sock'
+
+    def setUp(self):
+        for top_name in 'AB':
+            os.makedirs(os.path.join(self.testfn, top_name, 'SUB'))
+            f = open(os.path.join(self.testfn, top_name, 'file'), 'w')
+            f.close()
+
+        self.server = betterwalk.WalkServer(self.socket_path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.client = betterwalk.WalkClient(self.socket_path)
+
+    def test_walk(self):
+        for topdown in (True, False):
+            expected = list(betterwalk.walk(self.testfn, topdown=topdown))
+            walked = list(self.client.walk(self.testfn, topdown=topdown))
+            self.assertEqual(walked, expected)
+
+    def test_error(self):
+        errors = []
+        missing = os.path.join(self.testfn, 'missing')
+        walked = list(self.client.walk(missing, onerror=errors.append))
+        self.assertEqual(walked, [])
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].filename, missing)
+        self.assertEqual(errors[0].errno, errno.ENOENT)
+        self.assertEqual(errors[0].strerror, os.strerror(errno.ENOENT))
+
+    def test_pattern_and_fields(self):
+        a_path = os.path.join(self.testfn, 'A')
+        self.assertEqual(
+            [name for name, st in self.client.iterdir_stat(a_path, 'f*')],
+            ['file'])
+        self.assertEqual(
+            [name for name, st in self.client.iterdir_stat(a_path, '*.py')],
+            [])
+        self.assertRaises(ValueError, self.client.iterdir_stat, a_path,
+                          fields=['st_size'])
+
+    def test_bad_requests(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        f = sock.makefile('rb')
+        try:
+            # Invalid path encoding gets an error, and the connection stays
+            # usable
+            sock.sendall(struct.pack('!I', 2) + b'\xff\xfe')
+            error, size = struct.unpack('!iI', f.read(8))
+            f.read(size)
+            self.assertEqual(error, errno.EINVAL)
+            encoded = self.testfn.encode('utf-8')
+            sock.sendall(struct.pack('!I', len(encoded)) + encoded)
+            error, size = struct.unpack('!iI', f.read(8))
+            f.read(size)
+            self.assertEqual(error, 0)
+
+            # Huge path length gets an error without the server reading it
+            sock.sendall(struct.pack('!I', 0xFFFFFFFF))
+            error, size = struct.unpack('!iI', f.read(8))
+            f.read(size)
+            self.assertEqual(error, errno.EINVAL)
+            self.assertEqual(f.read(1), b'')
+        finally:
+            f.close()
+            sock.close()
+
+    def test_failed_read_not_cached(self):
+        class FlakyCache(betterwalk.ListingCache):
+            reads = 0
+            def read(self, path):
+                FlakyCache.reads += 1
+                time.sleep(0.1)
+                if FlakyCache.reads == 1:
+                    raise RuntimeError('flaky')
+                return betterwalk.ListingCache.read(self, path)
+
+        cache = FlakyCache()
+        responses = []
+        first = threading.Thread(target=lambda: self.assertRaises(
+            RuntimeError, cache.get, self.testfn))
+        waiter = threading.Thread(
+            target=lambda: responses.append(cache.get(self.testfn)))
+        first.start()
+        time.sleep(0.02)
+        waiter.start()
+        first.join()
+        waiter.join()
+
+        # The waiter retried the read itself, and only it got cached
+        self.assertEqual(FlakyCache.reads, 2)
+        self.assertEqual(responses[0][0], 0)
+        self.assertEqual(cache.get(self.testfn), responses[0])
+        self.assertEqual(FlakyCache.reads, 2)
+
+    def test_merge_concurrent_reads(self):
+        class SlowCache(betterwalk.ListingCache):
+            reads = 0
+            def read(self, path):
+                SlowCache.reads += 1
+                time.sleep(0.1)
+                return betterwalk.ListingCache.read(self, path)
+
+        cache = SlowCache()
+        responses = []
+        threads = [threading.Thread(
+                       target=lambda: responses.append(cache.get(self.testfn)))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(SlowCache.reads, 1)
+        self.assertEqual(len(responses), 5)
+        self.assertEqual(len(set(responses)), 1)
+
+    def test_cache_eviction_and_expiry(self):
+        class CountingCache(betterwalk.ListingCache):
+            def read(self, path):
+                self.reads.append(path)
+                return betterwalk.ListingCache.read(self, path)
+
+        a_path = os.path.join(self.testfn, 'A')
+        b_path = os.path.join(self.testfn, 'B')
+        c_path = os.path.join(self.testfn, 'A', 'SUB')
+
+        # A is used more recently than B, so adding C drops B
+        cache = CountingCache(max_size=2)
+        cache.reads = []
+        for path in (a_path, b_path, a_path, c_path, a_path, b_path):
+            cache.get(path)
+        self.assertEqual(cache.reads, [a_path, b_path, c_path, b_path])
+        self.assertEqual(len(cache.listings), 2)
+
+        # Expired listings are read again
+        cache = CountingCache(max_age=0)
+        cache.reads = []
+        cache.get(a_path)
+        cache.get(a_path)
+        self.assertEqual(cache.reads, [a_path, a_path])
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        os.remove(self.socket_path)
+        shutil.rmtree(self.testfn)
@@ -0,0 +1,160 @@
+"""Tests for betterwalk.snapshot()."""
+
+import errno
+import os
+import shutil
+import unittest
+
+import betterwalk
+
+class SnapshotTests(unittest.TestCase):
+    testfn = os.path.join(os.path.dirname(__file__), 'temp_snapshot')
+
+    def setUp(self):
+        # Build TESTFN/{A,B}/SUB/ with files of different sizes and mtimes
+        self.sizes = {}
+        size = 0
+        for top_name in 'AB':
+            os.makedirs(os.path.join(self.testfn, top_name, 'SUB'))
+            for dir_path in (os.path.join(self.testfn, top_name),
+                             os.path.join(self.testfn, top_name, 'SUB')):
+                for name in ('file1', 'file2'):
+                    path = os.path.join(dir_path, name)
+                    size += 10
+                    f = open(path, 'w')
+                    f.write('x' * size)
+                    f.close()
+                    os.utime(path, (size, size))
+                    self.sizes[path] = size
+        self.snap = betterwalk.snapshot(self.testfn,
+                                        fields=['st_size', 'st_mtime'])
+
+    def test_walk(self):
+        for topdown in (True, False):
+            expected = list(betterwalk.walk(self.testfn, topdown=topdown))
+            self.assertEqual(list(self.snap.walk(topdown=topdown)), expected)
+
+        a_path = os.path.join(self.testfn, 'A')
+        self.assertEqual(list(self.snap.walk(a_path)),
+                         list(betterwalk.walk(a_path)))
+
+        # Prune the walk
+        walked = []
+        for root, dirs, files in self.snap.walk():
+            walked.append(root)
+            if 'B' in dirs:
+                dirs.remove('B')
+        self.assertEqual(sorted(walked), [self.testfn, a_path,
+                                          os.path.join(a_path, 'SUB')])
+
+    def test_queries(self):
+        a_path = os.path.join(self.testfn, 'A')
+        self.assertEqual(len(self.snap), 13)
+        self.assertEqual(self.snap.count(a_path), 5)
+        self.assertEqual(sorted(self.snap.listdir(a_path)),
+                         ['SUB', 'file1', 'file2'])
+        self.assertEqual(self.snap.total_size(self.testfn),
+                         sum(self.sizes.values()))
+        self.assertEqual(self.snap.total_size(a_path), 10 + 20 + 30 + 40)
+        self.assertRaises(KeyError, self.snap.index,
+                          os.path.join(self.testfn, 'missing'))
+
+        by_size = sorted(((s, p) for p, s in self.sizes.items()),
+                         reverse=True)
+        self.assertEqual(self.snap.largest(3), by_size[:3])
+        self.assertEqual(self.snap.newest(3), [(float(s), p) for s, p in
+                                               by_size[:3]])
+        self.assertEqual(self.snap.largest(2, a_path),
+                         [(40, os.path.join(a_path, 'SUB', 'file2')),
+                          (30, os.path.join(a_path, 'SUB', 'file1'))])
+
+    def test_no_fields(self):
+        snap = betterwalk.snapshot(self.testfn)
+        self.assertEqual(list(snap.walk()), list(betterwalk.walk(self.testfn)))
+        self.assertRaises(ValueError, snap.total_size, self.testfn)
+        self.assertRaises(ValueError, snap.largest, 1)
+        self.assertRaises(ValueError, betterwalk.snapshot, self.testfn,
+                          fields=['st_ino'])
+
+    def test_largest_zero(self):
+        self.assertEqual(self.snap.largest(0), [])
+        self.assertEqual(self.snap.newest(-1), [])
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'requires os.symlink')
+    def test_symlinks(self):
+        # Build LINKS/{real/{up -> .., file}, link -> real, dangling}
+        links_path = os.path.join(self.testfn, 'LINKS')
+        real_path = os.path.join(links_path, 'real')
+        os.makedirs(real_path)
+        f = open(os.path.join(real_path, 'file'), 'w')
+        f.close()
+        os.symlink('..', os.path.join(real_path, 'up'))
+        os.symlink('real', os.path.join(links_path, 'link'))
+        os.symlink('nowhere', os.path.join(links_path, 'dangling'))
+
+        errors = []
+        snap = betterwalk.snapshot(links_path, fields=['st_size', 'st_mtime'],
+                                   onerror=errors.append)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(snap), 6)
+        self.assertEqual(sorted(snap.listdir(links_path)),
+                         ['dangling', 'link', 'real'])
+        for topdown in (True, False):
+            self.assertEqual(list(snap.walk(topdown=topdown)),
+                             list(betterwalk.walk(links_path,
+                                                  topdown=topdown)))
+
+    def test_missing_top(self):
+        missing = os.path.join(self.testfn, 'missing')
+        for fields in (None, ['st_size']):
+            errors = []
+            snap = betterwalk.snapshot(missing, fields=fields,
+                                       onerror=errors.append)
+            self.assertEqual([e.errno for e in errors], [errno.ENOENT])
+            self.assertEqual(list(snap.walk()), [])
+
+    def test_memory_per_entry(self):
+        # Unique names are the worst case for name interning
+        photos_path = os.path.join(self.testfn, 'PHOTOS')
+        os.mkdir(photos_path)
+        for i in range(2000):
+            f = open(os.path.join(photos_path, 'IMG_%06d.jpg' % i), 'w')
+            f.close()
+
+        snap = betterwalk.snapshot(photos_path, fields=['st_size', 'st_mtime'])
+        arrays = [snap.name_offset, snap.sizes, snap.mtimes,
+                  snap.child_order, snap.dir_entry, snap.dir_len,
+                  snap.dir_parent, snap.dir_listed, snap.dir_total,
+                  snap.child_start]
+        num_bytes = (sum(a.itemsize * len(a) for a in arrays) +
+                     len(snap.name_data))
+        self.assertLess(num_bytes / float(len(snap)), 40)
+
+    def test_lookup_in_large_directory(self):
+        big_path = os.path.join(self.testfn, 'BIG')
+        os.mkdir(big_path)
+        for i in range(2000):
+            f = open(os.path.join(big_path, 'f%d' % i), 'w')
+            f.close()
+        snap = betterwalk.snapshot(self.testfn)
+
+        # Count name comparisons to check that lookups are a binary search
+        # rather than a scan of the directory
+        calls = []
+        name_bytes = snap.name_bytes
+        def counting_name_bytes(index):
+            calls.append(index)
+            return name_bytes(index)
+        snap.name_bytes = counting_name_bytes
+
+        for name in ('f0', 'f1234', 'f1999'):
+            path = os.path.join(big_path, name)
+            del calls[:]
+            self.assertEqual(snap.path(snap.index(path)), path)
+            self.assertTrue(len(calls) < 30, len(calls))
+        self.assertRaises(KeyError, snap.index,
+                          os.path.join(big_path, 'f2000'))
+        self.assertEqual(snap.count(big_path), 2000)
+
+    def tearDown(self):
+        shutil.rmtree(self.testfn)